@@ -1,28 +1,103 @@
 # Python
-from typing import Optional
+from asyncio import iscoroutinefunction
+from functools import lru_cache, wraps
+from os import SEEK_END
+from typing import Optional, TypedDict
 from enum import Enum
 
+# orjson
+import orjson
+
 # Pydantic
 from pydantic import BaseModel
 from pydantic import Field
-from pydantic import EmailStr
-from pydantic import HttpUrl
 
 # FastAPI
 from fastapi import FastAPI
 from fastapi import status
 from fastapi import HTTPException
 from fastapi import Body, Query, Path
-from fastapi import Form
+from fastapi import Form, Depends
 from fastapi import Header, Cookie
 from fastapi import File, UploadFile
+from fastapi import Request, Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import APIRoute, request_response
+
+# Routing
+
+
+class OrjsonRequest(Request):
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body()) # Parse request bodies with orjson instead of the json module
+        return self._json
+
+
+class OrjsonRoute(APIRoute):
+    def get_route_handler(self):
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            request = OrjsonRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return custom_route_handler
+
+
+class NoOutValidationRoute(OrjsonRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, endpoint, **kwargs)
+        if self.can_trust_response():
+            self.dependant.call = self.trust_response(self.dependant.call, self.status_code)
+            self.app = request_response(self.get_route_handler())
+
+    def can_trust_response(self):
+        ## Only wrap when FastAPI would just encode the result with the default ORJSONResponse
+        response_class = self.response_class
+        if isinstance(response_class, DefaultPlaceholder):
+            response_class = response_class.value
+        return (
+            iscoroutinefunction(self.dependant.call)
+            and self.response_field is None
+            and response_class is ORJSONResponse
+            and not self.uses_response_param(self.dependant)
+        )
+
+    @classmethod
+    def uses_response_param(cls, dependant):
+        ## An injected response, in the endpoint or in any dependency, can set status and headers that we would drop
+        return dependant.response_param_name is not None or any(
+            cls.uses_response_param(sub_dependant)
+            for sub_dependant in dependant.dependencies
+        )
+
+    @staticmethod
+    def trust_response(endpoint, status_code):
+        ## FastAPI returns Response objects as they are, so wrapping the result skips serialize_response
+        @wraps(endpoint)
+        async def trusted_endpoint(*args, **kwargs):
+            content = await endpoint(*args, **kwargs)
+            if isinstance(content, Response):
+                return content
+            status_code_or_default = status_code or status.HTTP_200_OK
+            try:
+                return ORJSONResponse(content, status_code=status_code_or_default)
+            except TypeError: # orjson can't encode it (models, sets, Decimal...), so we fall back to jsonable_encoder
+                return ORJSONResponse(jsonable_encoder(content), status_code=status_code_or_default)
 
-app = FastAPI()
+        return trusted_endpoint
+
+
+app = FastAPI(default_response_class=ORJSONResponse)
+app.router.route_class = NoOutValidationRoute
 
 # Models
 
 
-class HairColor(Enum):
+class HairColor(str, Enum):
     white = "white"
     brown = "brown"
     black = "black"
@@ -30,37 +105,52 @@ class HairColor(Enum):
     red = "red"
 
 
+# Module level constants shared by the models
+
+_NAME_LENGTH = {"min_length": 1, "max_length": 50}
+
+## Plain regex checks instead of EmailStr and HttpUrl parsers, \Z because $ also matches before a trailing newline
+_EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+\Z"
+_URL_PATTERN = r"^https?://\S+\Z"
+
+_PERSON_EXAMPLE = { ## This key shold be always named "example" in schema_extra
+    "first_name": "Azkur",
+    "last_name": "Dev",
+    "age": 38,
+    "hair_color": HairColor.brown,
+    "is_married": True,
+    "email": "azkur.zone@gmail.com",
+    "personal_site": "https://www.azkur.com",
+    "password": "123454678"
+}
+
+
 class Location(BaseModel):
     city: str = Field(
         ...,
-        min_length=1,
-        max_length=50,
+        **_NAME_LENGTH,
         example="Campeche"
     )
     state: str = Field(
         ...,
-        min_length=1,
-        max_length=50,
+        **_NAME_LENGTH,
         example="Campeche"
     )
     country: str = Field(
         ...,
-        min_length=1,
-        max_length=50,
+        **_NAME_LENGTH,
         example="Mexico"
     )
 
 
-class PersonBase(BaseModel): # We create this clss to implement inheritance with Person and PersonOUT classes
+class PersonBase(BaseModel): # We create this clss to implement inheritance with Person class
     first_name: str = Field(
         ...,
-        min_length=1,
-        max_length=50
+        **_NAME_LENGTH
     )
     last_name: str = Field(
         ...,
-        min_length=1,
-        max_length=50
+        **_NAME_LENGTH
     )
     age: int = Field(
         ...,
@@ -69,26 +159,19 @@ class PersonBase(BaseModel): # We create this clss to implement inheritance with
     )
     hair_color: Optional[HairColor] = Field(default=None)
     is_married: Optional[bool] = Field(default=None)
-    email: EmailStr = Field(
-        ...
+    email: str = Field(
+        ...,
+        regex=_EMAIL_PATTERN
+    )
+    personal_site: Optional[str] = Field(
+        default=None,
+        regex=_URL_PATTERN
     )
-    personal_site: Optional[HttpUrl] = Field(default=None)
     
     ## We could do this or we can enter an extra field in each parameter as "example" as we can see in Location class
 
     class Config:
-        schema_extra = {
-            "example": { ## This key shold be always named "example"
-                "first_name": "Azkur",
-                "last_name": "Dev",
-                "age": 38,
-                "hair_color": HairColor.brown,
-                "is_married": True,
-                "email": "azkur.zone@gmail.com",
-                "personal_site": "https://www.azkur.com",
-                "password": "123454678"
-            }
-        }
+        schema_extra = {"example": _PERSON_EXAMPLE}
 
 
 class Person(PersonBase):
@@ -98,31 +181,74 @@ class Person(PersonBase):
     )
 
 
-class PersonOut(PersonBase):
-    pass
+## Response only models are TypedDicts, they are never validated, only serialized
 
 
-class LoginOut(BaseModel):
-    username: str = Field(
-        ...,
-        max_length=20,
-        example="username2022"
-    )
-    message: str = Field(default="Login Succesfully!")
+class PersonOut(TypedDict):
+    first_name: str
+    last_name: str
+    age: int
+    hair_color: Optional[HairColor]
+    is_married: Optional[bool]
+    email: str
+    personal_site: Optional[str]
+
+
+class LoginOut(TypedDict):
+    username: str
+    message: str
+
+
+class ContactForm(BaseModel):
+    first_name: str
+    last_name: str
+    email: str
+    message: str
+
+    @classmethod
+    async def as_form(
+        cls,
+        first_name: str = Form(
+            ...,
+            max_length=20,
+            min_length=1
+        ),
+        last_name: str = Form(
+            ...,
+            max_length=20,
+            min_length=1
+        ),
+        email: str = Form(
+            ...,
+            regex=_EMAIL_PATTERN
+        ),
+        message: str = Form(
+            ...,
+            min_length= 20
+        )
+    ):
+        return cls.construct( # Form already validated the fields, so we don't validate them again
+            first_name=first_name,
+            last_name=last_name,
+            email=email,
+            message=message
+        )
+
+_HOME_BODY = b'{"Hello":"world"}' # Constant body, encoded once for every request
 
 @app.get(
     path="/",
     status_code=status.HTTP_200_OK,
     tags=["Home"]
     )
-def home():
+async def home():
     """
     # home
 
     ## Returns:
         Body(): Return a response body with a greeting message.
     """
-    return {"Hello": "world"}
+    return Response(content=_HOME_BODY, media_type="application/json")
 
 # Request and Response Body
 
@@ -130,11 +256,12 @@ def home():
 @app.post(
     path="/person/new",
     status_code=status.HTTP_201_CREATED,
-    response_model=PersonOut,
+    response_model=None,
+    responses={status.HTTP_201_CREATED: {"model": PersonOut}},
     tags=["Person"],
     summary="Create person in the app"
-    ) # This is the response_model
-def create_person(person: Person = Body(...)):
+    ) # PersonOut only documents the response, the body is built by hand
+async def create_person(person: Person = Body(...)):
     """
     # create_person
     
@@ -148,14 +275,17 @@ def create_person(person: Person = Body(...)):
             - age (int): User age.
             - hair_color (HairColor, optional): User hair color. Defaults to None.
             - is_married (bool, optional): User married status. Defaults to None.
-            - email (EmailStr): User email.
+            - email (str): User email.
 
 
     ## Returns:
     
         Body(): Person model.
     """
-    return person
+    return ORJSONResponse(
+        person.dict(exclude={"password"}),
+        status_code=status.HTTP_201_CREATED
+        )
 
 # Validations: Query parameters
 ## Query and path parameters can set authomatic examples with key example in pydantic Field
@@ -168,7 +298,7 @@ def create_person(person: Person = Body(...)):
     summary="Get Person detail",
     deprecated=True
     )
-def show_person(
+async def show_person(
     name: Optional[str] = Query(
         None,
         min_length=1,
@@ -202,7 +332,14 @@ def show_person(
 
 # Validations: Path Parameters
 
-persons = [1, 2, 3, 4, 5]
+_PERSONS = frozenset({1, 2, 3, 4, 5})
+
+
+@lru_cache(maxsize=1024)
+def _person_detail_payload(person_id: int) -> Optional[bytes]:
+    if person_id not in _PERSONS:
+        return None
+    return orjson.dumps({str(person_id): "It exists!"}) # _PERSONS is immutable, so the payload can be cached
 
 @app.get(
     path="/person/detail{person_id}",
@@ -210,7 +347,7 @@ persons = [1, 2, 3, 4, 5]
     tags=["Person"],
     summary="Get person detail"
     )
-def show_person(
+async def show_person_by_id(
     person_id: int = Path(
         ...,
         gt=0,
@@ -220,9 +357,9 @@ def show_person(
         )
 ):
     """
-    # show_person
-    
+    # show_person_by_id
     
+    This endpoint recives a path parameter and informs if the person ID exists.
 
     ## Args:
     
@@ -236,12 +373,13 @@ def show_person(
     
         Body(): Return a response body with a value informs that ID exists.
     """
-    if person_id not in persons:
+    payload = _person_detail_payload(person_id)
+    if payload is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="This person doesn't exists!"
         )
-    return {person_id: "It exists!"}
+    return Response(content=payload, media_type="application/json")
 
 # Validations: Request Body
 
@@ -249,10 +387,11 @@ def show_person(
 @app.put(
     path="/person/{person_id}",
     status_code=status.HTTP_200_OK,
+    response_model=None,
     tags=["Person"],
     summary="Update person data"
     )
-def update_person(
+async def update_person(
     person_id: int = Path(
             ...,
         title="Person ID",
@@ -277,7 +416,7 @@ def update_person(
             - age (int): User age.
             - hair_color (HairColor, optional): User hair color. Defaults to None.
             - is_married (bool, optional): User married status. Defaults to None.
-            - email (EmailStr): User email.
+            - email (str): User email.
         - location (Location): Location model.
             - city (str): Person City.
             - state (str): Person State.
@@ -288,20 +427,23 @@ def update_person(
         Body(): Person model.
         Body(): Location model.
     """
-    results = person.dict()
-    results.update(location.dict())
-    return results
+    return Response(
+        content=orjson.dumps({**person.__dict__, **location.__dict__}), # Fields are flat, orjson serializes them by itself
+        media_type="application/json"
+    )
 
 @app.put(
     path="/person/location/{person_id}",
     status_code=status.HTTP_200_OK,
+    response_model=None,
+    responses={status.HTTP_200_OK: {"model": Location}},
     tags=["Person"],
     summary="Update persn location data"
     )
-def updat_location(
+async def updat_location(
     person_id: int = Path(
         ...,
-        titel="Person ID",
+        title="Person ID",
         description="This is the person ID",
         gt=0,
         example=333,
@@ -326,16 +468,20 @@ def updat_location(
     
         Body(): Location model.
     """
-    return location
+    return Response(
+        content=orjson.dumps(location.__dict__),
+        media_type="application/json"
+    )
 
 @app.post(
     path="/login",
-    response_model=LoginOut,
+    response_model=None,
+    responses={status.HTTP_200_OK: {"model": LoginOut}},
     status_code=status.HTTP_200_OK,
     tags=["Person"],
     summary="Login area"
 )
-def login(
+async def login(
     username: str = Form(...),
     password: str = Form(...)
     ):
@@ -352,9 +498,9 @@ def login(
     
         Body(): Return a response body with de username and a message of succesfuly login.
     """
-    return LoginOut(
-        username=username
-        ) # We need to instance the LoginOut CLASS method to return the response
+    return ORJSONResponse(
+        LoginOut(username=username, message="Login Succesfully!")
+        )
 
 # Cookies and headers parameters
 
@@ -365,22 +511,8 @@ def login(
     tags=["Form"],
     summary="Contact area"
 )
-def contact(
-    first_name: str = Form(
-        ...,
-        max_length=20,
-        min_length=1
-    ),
-    last_name: str = Form(
-        ...,
-        max_length=20,
-        min_length=1
-    ),
-    email: EmailStr = Form(...),
-    message: str = Form(
-        ...,
-        min_length= 20
-    ),
+async def contact(
+    form: ContactForm = Depends(ContactForm.as_form),
     user_agent: Optional[str] = Header(default=None),
     ads: Optional[str] = Cookie(default=None)
 ):
@@ -391,10 +523,11 @@ def contact(
 
     ## Args:
     
-        - first_name (str): Person name.
-        - last_name (str): Person last name.
-        - email (EmailStr): Person email.
-        - message (str): Message to be send.
+        - form (ContactForm): Contact form model.
+            - first_name (str): Person name.
+            - last_name (str): Person last name.
+            - email (str): Person email.
+            - message (str): Message to be send.
         - user_agent (Optional[str], optional): Web browser data. Defaults to Header(default=None).
         - ads (Optional[str], optional): Web browser cookies. Defaults to Cookie(default=None).
 
@@ -410,7 +543,7 @@ def contact(
     tags=["Upload"],
     summary="Image upload"
 )
-def post_image(
+async def post_image(
     image: UploadFile = File(...)
 ):
     """
@@ -426,8 +559,49 @@ def post_image(
     
         Body(): Return a ressponse body with the technical data about the image.
     """
+    image.file.seek(0, SEEK_END) # Get the size without reading the file into memory
+    size = image.file.tell()
+    image.file.seek(0)
     return {
         "Filename": image.filename,
         "Format": image.content_type,
-        "Size(kb)": round(len(image.file.read())/1024, ndigits=2)
-    }
\ No newline at end of file
+        "Size(kb)": round(size/1024, ndigits=2)
+    }
+
+# OpenAPI schema
+
+## The default /openapi.json route re-encodes the schema on every hit, so we serve bytes encoded once on the first hit
+app.router.routes = [
+    route for route in app.router.routes
+    if getattr(route, "path", None) != app.openapi_url
+]
+app.state.openapi_bytes = None
+
+
+@app.get(
+    path=app.openapi_url,
+    include_in_schema=False
+)
+async def openapi_schema(request: Request):
+    """
+    # openapi_schema
+
+    This endpoint keeps the root_path handling of the default FastAPI route and caches the encoded schema.
+
+    ## Returns:
+
+        Body(): Return the OpenAPI schema encoded on the first request.
+    """
+    current_app = request.app
+    root_path = request.scope.get("root_path", "").rstrip("/")
+    server_urls = {url.get("url") for url in current_app.servers}
+    if root_path and current_app.root_path_in_servers and root_path not in server_urls:
+        current_app.servers.insert(0, {"url": root_path})
+        current_app.openapi_schema = None # The servers changed, so the cached schema and bytes are stale
+        current_app.state.openapi_bytes = None
+    if current_app.state.openapi_bytes is None:
+        current_app.state.openapi_bytes = orjson.dumps(current_app.openapi())
+    return Response(
+        content=current_app.state.openapi_bytes,
+        media_type="application/json"
+    )